@@ -10,15 +10,24 @@ ES-2020006-C-2430-50-USD-FOP  GLOBEX
 """
 
 
-from copy import copy
-from datetime import datetime, timedelta, timezone
+from collections import deque
+from contextlib import closing
+from datetime import date, datetime, timezone
 from decimal import Decimal
-from threading import Thread, Condition
-from typing import Optional, Dict, Any, List
-import shelve
+from functools import lru_cache
+from operator import attrgetter
+from pathlib import Path
+from queue import SimpleQueue, Empty
+from threading import Thread, Condition, Lock, Event as ThreadEvent
+from typing import Optional, Dict, Any, List, Deque, Tuple, Set, Callable
+import csv
+import pickle
+import sqlite3
+import time
+import zlib
 from tzlocal import get_localzone_name
 import pytz
-from queue import Empty, Queue
+import numpy as np
 import pandas as pd
 
 from vnpy.event import EventEngine
@@ -31,10 +40,7 @@ from ibapi.order_state import OrderState
 from ibapi.ticktype import TickType, TickTypeEnum
 from ibapi.wrapper import EWrapper
 from ibapi.common import BarData as IbBarData
-
-from ibapi.utils import intMaxString
-from ibapi.utils import floatMaxString
-from ibapi.utils import decimalMaxString
+from ibapi.common import UNSET_INTEGER, UNSET_DOUBLE, UNSET_DECIMAL
 
 from vnpy.trader.gateway import BaseGateway
 from vnpy.trader.object import (
@@ -159,6 +165,10 @@ TICKFIELD_IB2VT: Dict[int, str] = {
     14: "open_price",
 }
 
+# 切片数据字段映射（按tickType下标直接索引，避免回调中的字典查询）
+TICKFIELD_SIZE: int = 32
+TICKFIELD_IB2VT_LIST: tuple = tuple(TICKFIELD_IB2VT.get(i, None) for i in range(TICKFIELD_SIZE))
+
 # 账户类型映射
 ACCOUNTFIELD_IB2VT: Dict[str, str] = {
     "NetLiquidationByCurrency": "balance",
@@ -175,10 +185,20 @@ INTERVAL_VT2IB: Dict[Interval, str] = {
     Interval.DAILY: "1 day",
 }
 
+# 每天K线数量上限（用于预估历史数据缓冲区大小）
+INTERVAL_BARS_PER_DAY: Dict[Interval, int] = {
+    Interval.MINUTE: 1440,
+    Interval.HOUR: 24,
+    Interval.DAILY: 1,
+}
+
 # 其他常量
 LOCAL_TZ = ZoneInfo(get_localzone_name())
 JOIN_SYMBOL: str = "-"
 
+# pytz时区对象缓存
+PYTZ_CACHE: Dict[str, pytz.BaseTzInfo] = {}
+
 
 class IbGateway(BaseGateway):
     """
@@ -217,7 +237,10 @@ class IbGateway(BaseGateway):
     def close(self) -> None:
         """关闭接口"""
         self.api.close()
-        
+
+        # 退出前保存所有尚未保存的合约数据
+        self.api.save_contract_data()
+
         # 保存ib的合约信息文件夹，用户可读，但这个csv文件，不读回系统
         self.api.save_ib_contracts_details_to_csv()
 
@@ -247,6 +270,9 @@ class IbGateway(BaseGateway):
 
     def process_timer_event(self, event: Event) -> None:
         """定时事件处理"""
+        # 合约数据有更新时，批量保存至本地
+        self.api.save_contract_data()
+
         self.count += 1
         if self.count < 10:
             return
@@ -258,7 +284,7 @@ class IbGateway(BaseGateway):
 class IbApi(EWrapper):
     """IB的API接口"""
 
-    data_filename: str = "ib_contract_data.db"
+    data_filename: str = "ib_contract_data.sqlite"
     data_filepath: str = str(get_file_path(data_filename))
 
     def __init__(self, gateway: IbGateway) -> None:
@@ -268,7 +294,9 @@ class IbApi(EWrapper):
         self.gateway: IbGateway = gateway
         self.gateway_name: str = gateway.gateway_name
 
-        self.status: bool = False
+        self.running: ThreadEvent = ThreadEvent()     # 是否已连接TWS
+        self.subscribe_thread: Thread = None
+        self.cancel_thread: Thread = None
 
         self.reqid: int = 0
         self.orderid: int = 0
@@ -278,25 +306,45 @@ class IbApi(EWrapper):
         self.ticks: Dict[int, TickData] = {}
         self.orders: Dict[str, OrderData] = {}
         self.accounts: Dict[str, AccountData] = {}
+        self.accounts_by_key: Dict[Tuple[str, str], AccountData] = {}  # 按(账户名, 货币)索引的账户数据
         self.contracts: Dict[str, ContractData] = {}
 
         self.ib_contracts_details: Dict[str, ContractDetails] = {} # ib的contract details
+        self.symbol_cache: Dict[int, str] = {}     # conId到vnpy代码的缓存
+        self.dirty_symbols: Set[str] = set()       # 尚未保存至本地的合约代码
+        self.dirty_lock: Lock = Lock()
 
         self.tick_exchange: Dict[int, Exchange] = {}
-        self.subscribed: Dict[str, SubscribeRequest] = {}
-        self.data_ready: bool = False
+        self.compute_mid: Dict[int, bool] = {}   # 是否需要本地计算中间价作为最新价
+        self.pending_names: Dict[str, List[TickData]] = {}     # 等待合约信息补齐name字段的tick数据
+        self.pending_lock: Lock = Lock()
+        self.subscribed: Dict[str, SubscribeRequest] = {}     # 只在订阅线程中读写
+        self.data_ready_event: ThreadEvent = ThreadEvent()    # 行情数据是否可以订阅
         self.order_ready: bool = False
-        self.subscribeRequest_queue = Queue()
+        self.last_notice: Tuple[int, str] = None     # 上一条输出的系统信息通知
+        self.subscribe_queue: Deque[SubscribeRequest] = deque()
+        self.resubscribe_pending: bool = False     # 断线重连后是否需要重新订阅
+        self.subscribe_condition: Condition = Condition()
+        self.cancel_queue: SimpleQueue = SimpleQueue()     # 待发送的撤单请求(委托号, 撤单时间)
 
         self.history_req: HistoryRequest = None
-        self.history_condition: Condition = Condition()
+        self.history_event: ThreadEvent = ThreadEvent()
+        self.history_lock: Lock = Lock()       # 保护历史数据请求号和缓冲区
         self.history_buf: List[BarData] = []
+        self.history_dates: List[str] = []          # 尚未解析的原始历史数据时间
+        self.history_data: np.ndarray = np.empty((0, 5))    # 开高低收量的原始历史数据
+        self.history_count: int = 0
 
         self.client: EClient = EClient(self)
 
     def connectAck(self) -> None:
         """连接成功回报"""
-        self.status = True
+        self.running.set()
+        self.last_notice = None
+
+        # 重新连接后清空合约代码缓存
+        self.symbol_cache.clear()
+        clear_contract_cache()
         self.gateway.write_log("IB TWS连接成功")
 
         # 由于加载合约信息后，会发送on_contract事件，该事件会促使类似datarecorder订阅行情，但现在刚连接上，并一定是马上订阅行情的好时机
@@ -310,14 +358,15 @@ class IbApi(EWrapper):
         Important: The IBApi.EWrapper.nextValidID callback is commonly used to indicate that the connection is completed and other messages can be sent from the API client to TWS. 
         There is the possibility that function calls made prior to this time could be dropped by TWS
         """
-        self.data_ready = False
+        self.data_ready_event.clear()
         self.order_ready = False
 
         
 
     def connectionClosed(self) -> None:
         """连接断开回报"""
-        self.status = False
+        self.running.clear()
+        self.clear_cancel_queue()
         self.gateway.write_log("IB TWS连接断开")
 
     def nextValidId(self, orderId: int) -> None:
@@ -329,21 +378,25 @@ class IbApi(EWrapper):
         if not self.orderid:
             self.orderid = orderId
         
-        if not self.order_ready:
-            self.order_ready = True
-        
-        if not self.data_ready:
-            self.data_ready = True
+        # 每次下单后的reqIds也会触发该回调，只有连接后的首次回调才需要重新订阅
+        reconnected: bool = not self.order_ready
+        self.order_ready = True
+
+        self.data_ready_event.set()
 
         # 断线后重连，需要把订阅过的合约重新订阅
-        reqs: list = list(self.subscribed.values())
-        self.subscribed.clear()
-        for req in reqs:
-            self.subscribe(req)
+        if reconnected:
+            self.resubscribe()
         
-        # 启动负责订阅行情的线程，只在初始化成功后启动，该线程断线后会退出(self.status = False)
-        self.subscribeRequest_thread = Thread(target=self.subscribeRunner)
-        self.subscribeRequest_thread.start()
+        # 启动负责订阅行情的线程，只在初始化成功后启动，该线程断线后会退出(self.running被清除)
+        if not self.subscribe_thread or not self.subscribe_thread.is_alive():
+            self.subscribe_thread = Thread(target=self.subscribeRunner, daemon=True)
+            self.subscribe_thread.start()
+
+        # 启动负责发送撤单的线程，避免撤单时的网络发送阻塞策略线程
+        if not self.cancel_thread or not self.cancel_thread.is_alive():
+            self.cancel_thread = Thread(target=self.cancelRunner, daemon=True)
+            self.cancel_thread.start()
 
     def currentTime(self, time: int) -> None:
         """IB当前服务器时间回报"""
@@ -360,10 +413,16 @@ class IbApi(EWrapper):
         super().error(reqId, errorCode, errorString)
     
         # 2000-2999信息通知不属于报错信息
-        if reqId == self.history_reqid and errorCode not in range(2000, 3000):
-            self.history_condition.acquire()
-            self.history_condition.notify()
-            self.history_condition.release()
+        if errorCode not in range(2000, 3000):
+            # 先处理报错前已收到的数据，再通知等待的查询线程
+            self.finish_history(reqId)
+
+        # 2000-2999系统信息通知（不关联请求号）与上一条完全相同时不再输出，避免重连时大量重复日志
+        if errorCode in range(2000, 3000) and reqId < 0:
+            notice: Tuple[int, str] = (errorCode, errorString)
+            if notice == self.last_notice:
+                return
+            self.last_notice = notice
 
         msg: str = f"信息通知，代码：{errorCode}，内容: {errorString}"
         self.gateway.write_log(msg)
@@ -376,22 +435,19 @@ class IbApi(EWrapper):
         # TWS与IB服务器已经断线
         if errorCode == 1100:
             self.order_ready = False
-            self.data_ready = False
+            self.data_ready_event.clear()
         
         # TWS与IB服务器已经重连，需要重新订阅行情
         if errorCode == 1101:
             self.order_ready = True
-            self.data_ready = True
+            self.data_ready_event.set()
 
-            reqs: list = list(self.subscribed.values())
-            self.subscribed.clear()
-            for req in reqs:
-                self.subscribe(req)
+            self.resubscribe()
 
         # TWS与IB服务器已经重连，不需要做任何事情
         if errorCode == 1102:
             self.order_ready = True
-            self.data_ready = True
+            self.data_ready_event.set()
 
         '''
         # 行情服务器已连接
@@ -415,21 +471,15 @@ class IbApi(EWrapper):
         """tick价格更新回报"""
         super().tickPrice(reqId, tickType, price, attrib)
 
-        if tickType not in TICKFIELD_IB2VT:
+        name: str = TICKFIELD_IB2VT_LIST[tickType] if tickType < TICKFIELD_SIZE else None
+        if name is None:
             return
 
         tick: TickData = self.ticks[reqId]
-        name: str = TICKFIELD_IB2VT[tickType]
-        setattr(tick, name, price)
-
-        # 更新tick数据name字段
-        contract: ContractData = self.contracts.get(tick.vt_symbol, None)
-        if contract:
-            tick.name = contract.name
+        tick.__dict__[name] = price
 
         # 本地计算Forex of IDEALPRO和Spot Commodity的tick时间和最新价格
-        exchange: Exchange = self.tick_exchange[reqId]
-        if exchange is Exchange.IDEALPRO or "CMDTY" in tick.symbol:
+        if self.compute_mid[reqId]:
             if not tick.bid_price_1 or not tick.ask_price_1:
                 return
             tick.last_price = round((tick.bid_price_1 + tick.ask_price_1) / 2,5)
@@ -437,13 +487,13 @@ class IbApi(EWrapper):
 
 
         # datetime是quote update time，不是last trade time，所以每次行情变化，都修改这个time  
-        tick.datetime = datetime.now(LOCAL_TZ)
+        tick.datetime = now_local()
         """
         Market data tick price callback. Handles all price related ticks. Every tickPrice callback is followed by a tickSize. 
         A tickPrice value of -1 or 0 followed by a tickSize of 0 indicates there is no data for this field currently available, whereas a tickPrice with a positive tickSize indicates an active quote of 0 (typically for a combo contract).
         """
         # IB API描述中，有tickPrice变化，一定会紧跟一个tickSize变化，所以，tickSize没更新之前，没必要提交on_tick，否则反而会给出错误的tickSize
-        # self.gateway.on_tick(copy(tick))
+        # self.gateway.on_tick(clone_data(tick))
 
     def tickSize(
         self, reqId: TickerId, tickType: TickType, size: Decimal
@@ -454,17 +504,17 @@ class IbApi(EWrapper):
         """tick数量更新回报"""
         super().tickSize(reqId, tickType, size)
 
-        if tickType not in TICKFIELD_IB2VT:
+        name: str = TICKFIELD_IB2VT_LIST[tickType] if tickType < TICKFIELD_SIZE else None
+        if name is None:
             return
 
         tick: TickData = self.ticks[reqId]
-        name: str = TICKFIELD_IB2VT[tickType]
-        setattr(tick, name, size)
+        tick.__dict__[name] = size
 
         # datetime是quote update time，不是last trade time，所以每次行情变化，都修改这个time  
-        tick.datetime = datetime.now(LOCAL_TZ)
+        tick.datetime = now_local()
 
-        self.gateway.on_tick(copy(tick))
+        self.gateway.on_tick(clone_data(tick))
 
     def tickString(
         self, reqId: TickerId, tickType: TickType, value: str
@@ -482,7 +532,7 @@ class IbApi(EWrapper):
         dt: datetime = datetime.fromtimestamp(int(value))
         tick.datetime = dt.replace(tzinfo=LOCAL_TZ)
 
-        self.gateway.on_tick(copy(tick))
+        self.gateway.on_tick(clone_data(tick))
 
     def orderStatus(
         self,
@@ -525,7 +575,8 @@ class IbApi(EWrapper):
         if order_status:
             order.status = order_status
 
-        self.gateway.on_order(copy(order))
+        # 事件引擎异步处理推送，需要推送快照，否则后续状态更新会修改队列中尚未处理的数据
+        self.gateway.on_order(clone_data(order))
 
         self.gateway.write_log(f"orderStatus:{order}")
 
@@ -543,7 +594,7 @@ class IbApi(EWrapper):
 
         orderid: str = str(orderId)
         order: OrderData = OrderData(
-            symbol=generate_symbol(ib_contract),
+            symbol=self.get_symbol(ib_contract),
             exchange=EXCHANGE_IB2VT.get(ib_contract.exchange, Exchange.SMART),
             type=ORDERTYPE_IB2VT[ib_order.orderType],
             orderid=orderid,
@@ -559,7 +610,7 @@ class IbApi(EWrapper):
 
         self.orders[orderid] = order
         # 没必要发送此事件，因为每次OnOrderStatus都会前，都会发送一次OnOpenOrder，而且OnOpenOrder的order中，status一直都是submitting，回干扰策略的逻辑
-        #self.gateway.on_order(copy(order))
+        #self.gateway.on_order(clone_data(order))
 
     def updateAccountValue(
         self, key: str, val: str, currency: str, accountName: str
@@ -570,14 +621,15 @@ class IbApi(EWrapper):
         if not currency or key not in ACCOUNTFIELD_IB2VT:
             return
 
-        accountid: str = f"{accountName}.{currency}"
-        account: AccountData = self.accounts.get(accountid, None)
+        account: AccountData = self.accounts_by_key.get((accountName, currency), None)
         if not account:
+            accountid: str = f"{accountName}.{currency}"
             account = AccountData(
                 accountid=accountid,
                 gateway_name=self.gateway_name
             )
             self.accounts[accountid] = account
+            self.accounts_by_key[(accountName, currency)] = account
 
         name: str = ACCOUNTFIELD_IB2VT[key]
         setattr(account, name, float(val))
@@ -613,7 +665,7 @@ class IbApi(EWrapper):
             exchange: Exchange = Exchange.SMART   # Use smart routing for default
 
         if not exchange:
-            msg: str = f"存在不支持的交易所持仓{generate_symbol(contract)} {contract.exchange} {contract.primaryExchange}"
+            msg: str = f"存在不支持的交易所持仓{self.get_symbol(contract)} {contract.exchange} {contract.primaryExchange}"
             self.gateway.write_log(msg)
             return
 
@@ -624,7 +676,7 @@ class IbApi(EWrapper):
         price = averageCost / ib_size
 
         pos: PositionData = PositionData(
-            symbol=generate_symbol(contract),
+            symbol=self.get_symbol(contract),
             exchange=exchange,
             direction=Direction.NET,
             volume=float(position), # convert Decimal to float
@@ -638,7 +690,7 @@ class IbApi(EWrapper):
         """账号更新时间回报"""
         super().updateAccountTime(timeStamp)
         for account in self.accounts.values():
-            self.gateway.on_account(copy(account))
+            self.gateway.on_account(clone_data(account))
 
     def contractDetails(self, reqId: int, contractDetails: ContractDetails) -> None:
         """合约数据更新回报"""
@@ -651,6 +703,10 @@ class IbApi(EWrapper):
 
         symbol: str = generate_symbol(ib_contract)
 
+        # 以合约详情生成的代码为准刷新缓存，conId为0的合约无法缓存
+        if ib_contract.conId:
+            self.symbol_cache[ib_contract.conId] = symbol
+
         # 生成合约
         contract: ContractData = ContractData(
             symbol=symbol,
@@ -686,9 +742,28 @@ class IbApi(EWrapper):
         if contract.vt_symbol not in self.contracts:
             self.gateway.on_contract(contract)
 
-            self.contracts[contract.vt_symbol] = contract
+            with self.pending_lock:
+                self.contracts[contract.vt_symbol] = contract
+                ticks: List[TickData] = self.pending_names.pop(contract.vt_symbol, [])
+
             self.ib_contracts_details[contract.vt_symbol] = contractDetails
-            self.save_contract_data()
+            with self.dirty_lock:
+                self.dirty_symbols.add(contract.vt_symbol)
+
+            # 补齐合约信息到达之前已订阅的tick数据name字段
+            for tick in ticks:
+                tick.name = contract.name
+
+    def get_symbol(self, ib_contract: Contract) -> str:
+        """获取vnpy代码（按conId缓存）"""
+        if not ib_contract.conId:
+            return generate_symbol(ib_contract)
+
+        symbol: str = self.symbol_cache.get(ib_contract.conId, None)
+        if symbol is None:
+            symbol = generate_symbol(ib_contract)
+            self.symbol_cache[ib_contract.conId] = symbol
+        return symbol
 
     def execDetails(
         self, reqId: int, contract: Contract, execution: Execution
@@ -698,15 +773,15 @@ class IbApi(EWrapper):
 
         strTimeList = execution.time.split(" ")
         if len(strTimeList) > 2:
-            trade_tz = pytz.timezone(strTimeList[2])
-            dt: datetime = trade_tz.localize(datetime.strptime(strTimeList[0] + " " + strTimeList[1], "%Y%m%d %H:%M:%S"))
+            trade_tz = get_pytz_timezone(strTimeList[2])
+            dt: datetime = trade_tz.localize(parse_datetime(strTimeList[0], strTimeList[1]))
             # dt: datetime = datetime.strptime(execution.time, "%Y%m%d %H:%M:%S %%")
             # dt: datetime = dt.replace(tzinfo=LOCAL_TZ)
         else:
             dt: datetime = datetime.now(LOCAL_TZ)
 
         trade: TradeData = TradeData(
-            symbol=generate_symbol(contract),
+            symbol=self.get_symbol(contract),
             exchange=EXCHANGE_IB2VT.get(contract.exchange, Exchange.SMART),
             orderid=str(execution.orderId),
             tradeid=str(execution.execId),
@@ -733,39 +808,98 @@ class IbApi(EWrapper):
 
     def historicalData(self, reqId: int, ib_bar: IbBarData) -> None:
         """历史数据更新回报"""
-        # 日级别数据和周级别日期数据的数据形式为%Y%m%d
-        if len(ib_bar.date) > 8:
-            dt: datetime = generate_localtime(ib_bar.date) # 时间样式：20230629 10:30:00 Hongkong。datetime.strptime(ib_bar.date, "%Y%m%d %H:%M:%S")
-        else:
-            dt: datetime = datetime.strptime(ib_bar.date, "%Y%m%d")
-        dt: datetime = dt.replace(tzinfo=LOCAL_TZ)
+        with self.history_lock:
+            # 过滤已超时请求的数据
+            if reqId != self.history_reqid:
+                return
 
-        bar: BarData = BarData(
-            symbol=self.history_req.symbol,
-            exchange=self.history_req.exchange,
-            datetime=dt,
-            interval=self.history_req.interval,
-            volume=ib_bar.volume,
-            open_price=ib_bar.open,
-            high_price=ib_bar.high,
-            low_price=ib_bar.low,
-            close_price=ib_bar.close,
-            gateway_name=self.gateway_name
-        )
-        if bar.volume < 0:
-            bar.volume = 0
+            # 先缓存原始数据，等查询完毕后再批量解析时间和生成K线
+            if self.history_count == len(self.history_data):
+                self.allocate_history_data(max(len(self.history_data) * 2, 1024))
 
-        self.history_buf.append(bar)
+            self.history_data[self.history_count] = (
+                ib_bar.open,
+                ib_bar.high,
+                ib_bar.low,
+                ib_bar.close,
+                ib_bar.volume
+            )
+            self.history_dates.append(ib_bar.date)
+            self.history_count += 1
 
     def historicalDataEnd(self, reqId: int, start: str, end: str) -> None:
         """历史数据查询完毕回报"""
-        self.history_condition.acquire()
-        self.history_condition.notify()
-        self.history_condition.release()
+        self.finish_history(reqId)
+
+    def finish_history(self, reqId: int) -> None:
+        """结束历史数据请求，处理已收到的数据并通知等待的查询线程"""
+        with self.history_lock:
+            if not reqId or reqId != self.history_reqid:
+                return
+
+            self.process_history_buf()
+            self.history_reqid = 0
+            self.history_event.set()
+
+    def allocate_history_data(self, size: int) -> None:
+        """分配历史数据缓冲区，保留已收到的数据"""
+        data: np.ndarray = np.empty((size, 5), dtype=np.float64)
+        data[:self.history_count] = self.history_data[:self.history_count]
+        self.history_data = data
+
+    def process_history_buf(self) -> None:
+        """批量解析历史数据时间并生成K线"""
+        dates: List[str] = self.history_dates
+        data: np.ndarray = self.history_data[:self.history_count]
+
+        self.history_dates = []
+        self.history_data = np.empty((0, 5))
+        self.history_count = 0
+
+        if not dates:
+            return
+
+        # 成交量为负时（如外汇）修正为0
+        np.maximum(data[:, 4], 0, out=data[:, 4])
+
+        # 日级别数据和周级别日期数据的数据形式为%Y%m%d
+        if len(dates[0]) > 8:
+            # 时间样式：20230629 10:30:00 Hongkong，转换为上海时区时间
+            strs, tz_names = zip(*(date.rsplit(" ", 1) for date in dates))
+            index: pd.DatetimeIndex = pd.to_datetime(list(strs), format="%Y%m%d %H:%M:%S", cache=True)
+            index = index.tz_localize(
+                tz_names[0],
+                ambiguous=[False] * len(index),
+                nonexistent="shift_forward"
+            )
+            index = index.tz_convert("Asia/Shanghai").tz_localize(None)
+        else:
+            index: pd.DatetimeIndex = pd.to_datetime(dates, format="%Y%m%d", cache=True)
+
+        symbol: str = self.history_req.symbol
+        exchange: Exchange = self.history_req.exchange
+        interval: Interval = self.history_req.interval
+
+        self.history_buf = [
+            BarData(
+                symbol=symbol,
+                exchange=exchange,
+                datetime=dt.replace(tzinfo=LOCAL_TZ),
+                interval=interval,
+                volume=volume,
+                open_price=open_price,
+                high_price=high_price,
+                low_price=low_price,
+                close_price=close_price,
+                gateway_name=self.gateway_name
+            )
+            for dt, (open_price, high_price, low_price, close_price, volume)
+            in zip(index.to_pydatetime(), data.tolist())
+        ]
 
     def connect(self, host: str, port: int, clientid: int, account: str) -> None:
         """连接TWS"""
-        if self.status:
+        if self.running.is_set():
             return
 
         self.host = host
@@ -774,7 +908,7 @@ class IbApi(EWrapper):
         self.account = account
 
         self.client.connect(host, port, clientid)
-        self.thread = Thread(target=self.client.run)
+        self.thread = Thread(target=self.client.run, daemon=True)
         self.thread.start()
 
     def check_connection(self) -> None:
@@ -782,30 +916,33 @@ class IbApi(EWrapper):
         if self.client.isConnected():
             return
 
-        if self.status:
+        if self.running.is_set():
             self.close()
 
         self.client.connect(self.host, self.port, self.clientid)
 
-        self.thread = Thread(target=self.client.run)
+        self.thread = Thread(target=self.client.run, daemon=True)
         self.thread.start()
 
     def close(self) -> None:
         """断开TWS连接"""
-        if not self.status:
+        if not self.running.is_set():
             return
 
-        self.status = False
+        self.running.clear()
         self.client.disconnect()
+        self.clear_cancel_queue()
     
     def subscribe(self, req: SubscribeRequest) -> None:
-        """把待请阅的合约放入队列，后面由专门负责订阅行情的线程来处理订阅"""
-        self.subscribeRequest_queue.put(req)
+        """把待订阅的合约放入队列，后面由专门负责订阅行情的线程来批量处理订阅"""
+        with self.subscribe_condition:
+            self.subscribe_queue.append(req)
+            self.subscribe_condition.notify()
 
     '''
     def subscribe(self, req: SubscribeRequest) -> None:
         """订阅tick数据更新"""
-        if not self.status:
+        if not self.running.is_set():
             return
 
         if req.exchange not in EXCHANGE_VT2IB:
@@ -843,58 +980,102 @@ class IbApi(EWrapper):
         self.tick_exchange[self.reqid] = req.exchange
     '''
 
+    def resubscribe(self) -> None:
+        """通知订阅线程重新订阅所有已订阅过的合约"""
+        with self.subscribe_condition:
+            self.resubscribe_pending = True
+            self.subscribe_condition.notify()
+
     def subscribeRunner(self) -> None:
-        while self.status:
-            try:
-                # self.gateway.write_log(f"订阅行情队列{self.subscribeRequest_queue.qsize()}")
-                
-                if not self.status:
+        """批量处理行情订阅请求"""
+        while self.running.is_set():
+            # 等待行情数据就绪（超时用于检查连接状态）
+            if not self.data_ready_event.wait(timeout=1):
+                continue
+
+            # 等待新的订阅请求到达，并一次性取出队列中的全部请求
+            with self.subscribe_condition:
+                if not self.subscribe_queue and not self.resubscribe_pending:
+                    self.subscribe_condition.wait(timeout=1)
                     continue
 
-                if not self.data_ready:
-                    continue
+                reqs: List[SubscribeRequest] = list(self.subscribe_queue)
+                self.subscribe_queue.clear()
+
+                resubscribe: bool = self.resubscribe_pending
+                self.resubscribe_pending = False
+
+            # 断线重连后，先对已订阅过的合约做快照，这些合约跳过重复订阅过滤
+            if resubscribe:
+                resubscribe_reqs: tuple = tuple(self.subscribed.values())
+            else:
+                resubscribe_reqs: tuple = ()
 
-                req: SubscribeRequest = self.subscribeRequest_queue.get(block=True, timeout=1)
+            # 过滤不支持的交易所和重复订阅
+            new_reqs: List[SubscribeRequest] = []
+            for req in reqs:
                 if req.exchange not in EXCHANGE_VT2IB:
                     self.gateway.write_log(f"订阅行情{req.symbol}失败，不支持的交易所{req.exchange}")
                     continue
 
-                # 过滤重复订阅
                 if req.vt_symbol in self.subscribed:
                     continue
                 self.subscribed[req.vt_symbol] = req
+                new_reqs.append(req)
 
-                # 解析IB合约详情
+            # 解析IB合约详情，重新订阅的请求已在self.subscribed中，不需要再过滤
+            batch: List[Tuple[SubscribeRequest, Contract]] = []
+            for req in resubscribe_reqs + tuple(new_reqs):
                 ib_contract: Contract = generate_ib_contract(req.symbol, req.exchange)
                 if not ib_contract:
-                    self.gateway.write_log("订阅行情{req.symbol}失败。代码解析失败，请检查格式是否正确")
+                    self.gateway.write_log(f"订阅行情{req.symbol}失败。代码解析失败，请检查格式是否正确")
                     continue
 
-                # 通过TWS查询合约信息
-                self.reqid += 1
-                self.client.reqContractDetails(self.reqid, ib_contract)
+                batch.append((req, ib_contract))
 
-                #  订阅tick数据并创建tick对象缓冲区
-                self.reqid += 1
-                self.gateway.write_log(f"api订阅前reqid：{self.reqid},symbol:{req.symbol}")
-                self.client.reqMktData(self.reqid, ib_contract, "", False, False, [])
+            if not batch:
+                continue
 
+            # 一次性预留本批次需要的reqid（每个合约占用2个）
+            reqid: int = self.reqid
+            self.reqid += len(batch) * 2
+            first_reqid: int = reqid + 1
+
+            for req, ib_contract in batch:
+                # 通过TWS查询合约信息
+                reqid += 1
+                self.client.reqContractDetails(reqid, ib_contract)
+
+                # 先创建tick对象缓冲区，再订阅tick数据
+                reqid += 1
                 tick: TickData = TickData(
                     symbol=req.symbol,
                     exchange=req.exchange,
                     datetime=datetime.now(LOCAL_TZ),
                     gateway_name=self.gateway_name,
                 )
-                self.ticks[self.reqid] = tick
-                self.gateway.write_log(f"api订阅后reqid：{self.reqid},symbol:{req.symbol}")
-                self.tick_exchange[self.reqid] = req.exchange
 
-            except Empty:
-                pass
+                # 合约信息已缓存时直接更新tick数据name字段，否则等收到合约详情后再补齐
+                with self.pending_lock:
+                    contract: ContractData = self.contracts.get(tick.vt_symbol, None)
+                    if contract:
+                        tick.name = contract.name
+                    else:
+                        self.pending_names.setdefault(tick.vt_symbol, []).append(tick)
+
+                self.ticks[reqid] = tick
+                self.tick_exchange[reqid] = req.exchange
+                self.compute_mid[reqid] = req.exchange is Exchange.IDEALPRO or "CMDTY" in req.symbol
+
+                self.client.reqMktData(reqid, ib_contract, "", False, False, [])
+
+            # 每批次只输出一条订阅日志
+            symbols: str = ",".join(req.symbol for req, _ in batch)
+            self.gateway.write_log(f"api订阅行情{len(batch)}个，reqid：{first_reqid}-{reqid}，symbol:{symbols}")
 
     def send_order(self, req: OrderRequest) -> str:
         """委托下单"""
-        if not self.status:
+        if not self.running.is_set():
             return ""
         if not self.order_ready:
             self.gateway.write_log(f"API还没有完全初始化完毕,还没有收到nextValidID,暂不能下单。symbol:{req.vt_symbol},direction:{req.direction},price:{req.price},volume:{req.volume}")
@@ -941,15 +1122,41 @@ class IbApi(EWrapper):
 
     def cancel_order(self, req: CancelRequest) -> None:
         """委托撤单"""
-        if not self.status:
+        if not self.running.is_set():
             return
         if not self.order_ready:
             self.gateway.write_log(f"API还没有完全初始化完毕,还没有收到nextValidID,暂不能撤单。oderid:{req.orderid},symbol:{req.vt_symbol},direction:{req.direction},price:{req.price},volume:{req.volume}")
             return ""
 
         # IB API 10.9.1在撤单时，新增1个参数，撤单时间
-        manualCancelOrderTime:str = datetime.now(LOCAL_TZ).strftime("%Y%m%d-%H:%M:%S")
-        self.client.cancelOrder(int(req.orderid), manualCancelOrderTime)
+        manualCancelOrderTime: str = now_cancel_time()
+        self.cancel_queue.put_nowait((parse_orderid(req.orderid), manualCancelOrderTime))
+
+    def cancelRunner(self) -> None:
+        """依次发送撤单请求"""
+        while self.running.is_set():
+            # 超时用于检查连接状态
+            try:
+                orderid, manualCancelOrderTime = self.cancel_queue.get(timeout=1)
+            except Empty:
+                continue
+
+            # 等待期间连接已断开，撤单时间已过期，不再发送
+            if not self.running.is_set():
+                self.gateway.write_log(f"连接已断开，丢弃未发送的撤单请求：{orderid}")
+                break
+
+            self.client.cancelOrder(orderid, manualCancelOrderTime)
+
+    def clear_cancel_queue(self) -> None:
+        """清空尚未发送的撤单请求，避免重连后使用过期的撤单时间发送"""
+        while True:
+            try:
+                orderid, _ = self.cancel_queue.get_nowait()
+            except Empty:
+                return
+
+            self.gateway.write_log(f"连接已断开，丢弃未发送的撤单请求：{orderid}")
 
     def query_history(self, req: HistoryRequest) -> List[BarData]:
         """查询历史数据"""
@@ -958,21 +1165,19 @@ class IbApi(EWrapper):
             self.gateway.write_log(f"找不到合约：{req.vt_symbol}，请先订阅")
             return []
 
-        self.history_req = req
-
         self.reqid += 1
 
         ib_contract: Contract = generate_ib_contract(req.symbol, req.exchange)
 
+        # 按自然日计算查询天数，未指定结束时间时直接使用本地日期
         if req.end:
-            end: datetime = req.end
-            end_str: str = end.strftime("%Y%m%d %H:%M:%S")
+            end_str: str = req.end.strftime("%Y%m%d %H:%M:%S")
+            delta_days: int = (req.end.date() - req.start.date()).days
         else:
-            end: datetime = datetime.now(LOCAL_TZ)
             end_str: str = ""
+            delta_days: int = (date.today() - req.start.date()).days
 
-        delta: timedelta = end - req.start
-        days: int = min(delta.days, 180)     # IB 只提供6个月数据
+        days: int = min(max(delta_days, 1), 180)     # IB 只提供6个月数据，且至少查询1天
         duration: str = f"{days} D"
         bar_size: str = INTERVAL_VT2IB[req.interval]
 
@@ -981,9 +1186,20 @@ class IbApi(EWrapper):
         else:
             bar_type: str = "TRADES"
 
-        self.history_reqid = self.reqid
+        reqid: int = self.reqid
+        with self.history_lock:
+            # 按请求的时间范围预先分配历史数据缓冲区
+            self.history_req = req
+            self.history_buf = []
+            self.history_dates = []
+            self.history_count = 0
+            self.allocate_history_data((days + 1) * INTERVAL_BARS_PER_DAY[req.interval])
+
+            self.history_reqid = reqid
+            self.history_event.clear()
+
         self.client.reqHistoricalData(
-            self.reqid,
+            reqid,
             ib_contract,
             end_str,
             duration,
@@ -995,22 +1211,48 @@ class IbApi(EWrapper):
             []
         )
 
-        self.history_condition.acquire()    # 等待异步数据返回
-        self.history_condition.wait()
-        self.history_condition.release()
+        # 等待异步数据返回
+        self.history_event.wait(timeout=60)
 
-        history: List[BarData] = self.history_buf
-        self.history_buf: List[BarData] = []       # 创新新的缓冲列表
-        self.history_req: HistoryRequest = None
+        with self.history_lock:
+            # 请求号未被回调清除说明已超时，放弃本次查询，之后到达的数据会被过滤
+            timeout: bool = self.history_reqid == reqid
+            self.history_reqid = 0
+
+            history: List[BarData] = self.history_buf
+            self.history_buf: List[BarData] = []       # 创新新的缓冲列表
+            self.history_dates: List[str] = []
+            self.history_data: np.ndarray = np.empty((0, 5))
+            self.history_count: int = 0
+            self.history_req: HistoryRequest = None
+
+        # 超时后通知TWS取消该请求，避免继续推送数据并占用历史数据查询限额
+        if timeout:
+            self.client.cancelHistoricalData(reqid)
+            self.gateway.write_log(f"查询历史数据超时：{req.vt_symbol}")
 
         return history
 
+    def open_contract_db(self) -> sqlite3.Connection:
+        """打开本地合约数据库"""
+        db: sqlite3.Connection = sqlite3.connect(self.data_filepath)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS contracts (vt_symbol TEXT PRIMARY KEY, blob BLOB)")
+        db.execute("CREATE TABLE IF NOT EXISTS ib_contracts_details (vt_symbol TEXT PRIMARY KEY, blob BLOB)")
+        return db
+
     def load_contract_data(self) -> None:
         """加载本地合约数据"""
-        f = shelve.open(self.data_filepath)
-        self.contracts = f.get("contracts", {})
-        self.ib_contracts_details = f.get("ib_contracts_details", {})
-        f.close()
+        with closing(self.open_contract_db()) as db:
+            self.contracts = {
+                vt_symbol: load_blob(blob)
+                for vt_symbol, blob in db.execute("SELECT vt_symbol, blob FROM contracts")
+            }
+            self.ib_contracts_details = {
+                vt_symbol: load_blob(blob)
+                for vt_symbol, blob in db.execute("SELECT vt_symbol, blob FROM ib_contracts_details")
+            }
 
         for contract in self.contracts.values():
             self.gateway.on_contract(contract)
@@ -1018,168 +1260,73 @@ class IbApi(EWrapper):
         self.gateway.write_log("本地缓存合约信息加载成功")
 
     def save_contract_data(self) -> None:
-        """保存合约数据至本地"""
-        f = shelve.open(self.data_filepath)
-        f["contracts"] = self.contracts
-        f["ib_contracts_details"] = self.ib_contracts_details
-        f.close()
+        """保存有更新的合约数据至本地"""
+        with self.dirty_lock:
+            if not self.dirty_symbols:
+                return
+
+            dirty_symbols: Set[str] = self.dirty_symbols
+            self.dirty_symbols = set()
+
+        contracts: list = [
+            (vt_symbol, self.contracts[vt_symbol])
+            for vt_symbol in dirty_symbols if vt_symbol in self.contracts
+        ]
+        details: list = [
+            (vt_symbol, self.ib_contracts_details[vt_symbol])
+            for vt_symbol in dirty_symbols if vt_symbol in self.ib_contracts_details
+        ]
+
+        with closing(self.open_contract_db()) as db:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO contracts VALUES (?, ?)",
+                    [(vt_symbol, dump_blob(contract)) for vt_symbol, contract in contracts]
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO ib_contracts_details VALUES (?, ?)",
+                    [(vt_symbol, dump_blob(detail)) for vt_symbol, detail in details]
+                )
 
     def save_ib_contracts_details_to_csv(self) -> None:
         """保存ib的合约信息文件夹,用户可读,但这个csv文件,不读回系统"""
-        folder_path = str(get_folder_path("contracts_info"))
-        contracts_info_filepath: str = folder_path + "\\ib_contracts_info.csv"
-        
-        header = [  'conId',
-                    'symbol',
-                    'secType',
-                    'lastTradeDateOrContractMonth',
-                    'strike',
-                    'right',
-                    'multiplier',
-                    'exchange',
-                    'primaryExchange',
-                    'currency',
-                    'localSymbol',
-                    'tradingClass',
-                    'includeExpired',
-                    'secIdType',
-                    'secId',
-                    'description',
-                    'issuerId',
-                    'comboLegsDescrip',
-                    'comboLegs',
-                    'deltaNeutralContract',
-                    'marketName',
-                    'minTick',
-                    'orderTypes',
-                    'validExchanges',
-                    'priceMagnifier',
-                    'underConId',
-                    'longName',
-                    'contractMonth',
-                    'industry',
-                    'category',
-                    'subcategory',
-                    'timeZoneId',
-                    'tradingHours',
-                    'liquidHours',
-                    'evRule',
-                    'evMultiplier',
-                    'aggGroup',
-                    'underSymbol',
-                    'underSecType',
-                    'marketRuleIds',
-                    'secIdList',
-                    'realExpirationDate',
-                    'lastTradeTime',
-                    'stockType',
-                    'minSize',
-                    'sizeIncrement',
-                    'suggestedSizeIncrement',
-                    'cusip',
-                    'ratings',
-                    'descAppend',
-                    'bondType',
-                    'couponType',
-                    'callable',
-                    'putable',
-                    'coupon',
-                    'convertible',
-                    'maturity',
-                    'issueDate',
-                    'nextOptionDate',
-                    'nextOptionType',
-                    'nextOptionPartial',
-                    'notes'
-                  ]
-        data_list = []
-        for key,value in self.ib_contracts_details.items():
-            data_list.append(self.get_ib_contracts_details_str(value))
-        
-        df = pd.DataFrame(columns=header, data=data_list)
-        df.to_csv(contracts_info_filepath, header=True, index=False)
-    
-    def get_ib_contracts_details_str(self, c:ContractDetails) -> List:
-        str_list = []
-        
-        str_list.append(str(c.contract.conId))
-        str_list.append(str(c.contract.symbol))
-        str_list.append(str(c.contract.secType))
-        str_list.append(str(c.contract.lastTradeDateOrContractMonth))
-        str_list.append(floatMaxString(c.contract.strike))
-        str_list.append(str(c.contract.right))
-        str_list.append(str(c.contract.multiplier))
-        str_list.append(str(c.contract.exchange))
-        str_list.append(str(c.contract.primaryExchange))
-        str_list.append(str(c.contract.currency))
-        str_list.append(str(c.contract.localSymbol))
-        str_list.append(str(c.contract.tradingClass))
-        str_list.append(str(c.contract.includeExpired))
-        str_list.append(str(c.contract.secIdType))
-        str_list.append(str(c.contract.secId))
-        str_list.append(str(c.contract.description))
-        str_list.append(str(c.contract.issuerId))
-        str_list.append("combo:" + c.contract.comboLegsDescrip)
-
-        comboLegs = ""
-        if c.contract.comboLegs:
-            for leg in c.contract.comboLegs:
-                comboLegs += ";" + str(leg)
-        str_list.append(comboLegs)
-    
-        deltaNeutralContract = ""
-        if c.contract.deltaNeutralContract:
-            deltaNeutralContract += ";" + str(c.contract.deltaNeutralContract)
-        str_list.append(deltaNeutralContract)
-
-        str_list.append(str(c.marketName))
-        str_list.append(floatMaxString(c.minTick))
-        str_list.append(str(c.orderTypes))
-        str_list.append(str(c.validExchanges))
-        str_list.append(intMaxString(c.priceMagnifier))
-        str_list.append(intMaxString(c.underConId))
-        str_list.append(str(c.longName))
-        str_list.append(str(c.contractMonth))
-        str_list.append(str(c.industry))
-        str_list.append(str(c.category))
-        str_list.append(str(c.subcategory))
-        str_list.append(str(c.timeZoneId))
-        str_list.append(str(c.tradingHours))
-        str_list.append(str(c.liquidHours))
-        str_list.append(str(c.evRule))
-        str_list.append(intMaxString(c.evMultiplier))
-        str_list.append(intMaxString(c.aggGroup))
-        str_list.append(str(c.underSymbol))
-        str_list.append(str(c.underSecType))
-        str_list.append(str(c.marketRuleIds))       
-        str_list.append(str(c.secIdList))
-        str_list.append(str(c.realExpirationDate))
-        str_list.append(str(c.lastTradeTime))
-        str_list.append(str(c.stockType))
-        str_list.append(decimalMaxString(c.minSize))
-        str_list.append(decimalMaxString(c.sizeIncrement))
-        str_list.append(decimalMaxString(c.suggestedSizeIncrement))
-        str_list.append(str(c.cusip))
-        str_list.append(str(c.ratings))
-        str_list.append(str(c.descAppend))
-        str_list.append(str(c.bondType))
-        str_list.append(str(c.couponType))
-        str_list.append(str(c.callable))
-        str_list.append(str(c.putable))
-        str_list.append(str(c.coupon))
-        str_list.append(str(c.convertible))
-        str_list.append(str(c.maturity))
-        str_list.append(str(c.issueDate))
-        str_list.append(str(c.nextOptionDate))
-        str_list.append(str(c.nextOptionType))
-        str_list.append(str(c.nextOptionPartial))
-        str_list.append(str(c.notes))     
-
-        return str_list
+        contracts_info_filepath: Path = get_folder_path("contracts_info").joinpath("ib_contracts_info.csv")
+
+        # 逐行生成并直接写入，不在内存中构建完整的表格
+        details: List[ContractDetails] = list(self.ib_contracts_details.values())
+
+        with open(contracts_info_filepath, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(CONTRACT_DETAILS_HEADER)
+            writer.writerows(map(generate_contract_details_row, details))
+
+
+def dump_blob(data: Any) -> bytes:
+    """序列化并压缩合约数据"""
+    return zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def load_blob(blob: bytes) -> Any:
+    """解压并反序列化合约数据"""
+    return pickle.loads(zlib.decompress(blob))
+
+
+# 委托号字符串转整数（缓存结果）
+parse_orderid: Callable[[str], int] = lru_cache(maxsize=8192)(int)
 
 
 def generate_ib_contract(symbol: str, exchange: Exchange) -> Optional[Contract]:
     """生产IB合约"""
+    # 缓存的合约对象可能被调用方修改，所以返回拷贝
+    ib_contract: Optional[Contract] = parse_ib_contract(symbol, exchange)
+    if ib_contract:
+        ib_contract = clone_data(ib_contract)
+    return ib_contract
+
+
+@lru_cache(maxsize=4096)
+def parse_ib_contract(symbol: str, exchange: Exchange) -> Optional[Contract]:
+    """解析代码生成IB合约（缓存结果）"""
     try:
         fields: list = symbol.split(JOIN_SYMBOL)
 
@@ -1208,31 +1355,235 @@ def generate_ib_contract(symbol: str, exchange: Exchange) -> Optional[Contract]:
 
 def generate_symbol(ib_contract: Contract) -> str:
     """生成vnpy代码"""
-    fields: list = [ib_contract.symbol]
+    return join_symbol(
+        ib_contract.symbol,
+        ib_contract.secType,
+        ib_contract.lastTradeDateOrContractMonth,
+        ib_contract.right,
+        ib_contract.strike,
+        ib_contract.multiplier,
+        ib_contract.currency
+    )
+
+
+@lru_cache(maxsize=4096)
+def join_symbol(
+    symbol: str,
+    sec_type: str,
+    expiry: str,
+    right: str,
+    strike: float,
+    multiplier: str,
+    currency: str
+) -> str:
+    """拼接合约字段生成vnpy代码（缓存结果）"""
+    fields: list = [symbol]
+
+    if sec_type in ["FUT", "OPT", "FOP"]:
+        fields.append(expiry)
+
+    if sec_type in ["OPT", "FOP"]:
+        fields.append(right)
+        fields.append(str(strike))
+        fields.append(str(multiplier))
+
+    fields.append(currency)
+    fields.append(sec_type)
 
-    if ib_contract.secType in ["FUT", "OPT", "FOP"]:
-        fields.append(ib_contract.lastTradeDateOrContractMonth)
+    symbol: str = JOIN_SYMBOL.join(fields)
 
-    if ib_contract.secType in ["OPT", "FOP"]:
-        fields.append(ib_contract.right)
-        fields.append(str(ib_contract.strike))
-        fields.append(str(ib_contract.multiplier))
+    return symbol
 
-    fields.append(ib_contract.currency)
-    fields.append(ib_contract.secType)
 
-    symbol: str = JOIN_SYMBOL.join(fields)
+def get_pytz_timezone(name: str) -> pytz.BaseTzInfo:
+    """获取pytz时区（缓存已创建的时区对象）"""
+    tz: pytz.BaseTzInfo = PYTZ_CACHE.get(name, None)
+    if tz is None:
+        tz = pytz.timezone(name)
+        PYTZ_CACHE[name] = tz
+    return tz
+
+
+def parse_datetime(date_str: str, time_str: str) -> datetime:
+    """解析%Y%m%d和%H:%M:%S格式的日期时间（比strptime更快）"""
+    return datetime(
+        int(date_str[0:4]),
+        int(date_str[4:6]),
+        int(date_str[6:8]),
+        int(time_str[0:2]),
+        int(time_str[3:5]),
+        int(time_str[6:8])
+    )
+
+
+def format_float(value: float) -> str:
+    """生成浮点数字符串，未设置时为空（与ibapi的floatMaxString一致）"""
+    if value is None or value == UNSET_DOUBLE:
+        return ""
+    return f"{value:.8f}".rstrip("0").rstrip(".").rstrip(",")
+
+
+def format_int(value: int) -> str:
+    """生成整数字符串，未设置时为空（与ibapi的intMaxString一致）"""
+    if value is None or value == UNSET_INTEGER:
+        return ""
+    return str(value)
+
+
+def format_decimal(value: Decimal) -> str:
+    """生成Decimal字符串，未设置时为空（与ibapi的decimalMaxString一致）"""
+    if value is None:
+        return ""
+    if value.__class__ is not Decimal:
+        value = Decimal(value)
+    if value == UNSET_DECIMAL:
+        return ""
+    return f"{value:f}"
+
+
+def format_combo_legs_descrip(comboLegsDescrip: str) -> str:
+    """生成组合合约描述的字符串"""
+    return "combo:" + comboLegsDescrip
+
+
+def format_combo_legs(comboLegs: list) -> str:
+    """生成组合合约腿的字符串"""
+    if not comboLegs:
+        return ""
+    return "".join(";" + str(leg) for leg in comboLegs)
+
+
+def format_delta_neutral_contract(deltaNeutralContract: Any) -> str:
+    """生成Delta中性合约的字符串"""
+    if not deltaNeutralContract:
+        return ""
+    return ";" + str(deltaNeutralContract)
+
+
+# 合约详情导出字段（列名，属性路径，格式化函数）
+CONTRACT_DETAILS_FIELDS: Tuple[Tuple[str, str, Optional[Callable[[Any], str]]], ...] = (
+    ("conId", "contract.conId", None),
+    ("symbol", "contract.symbol", None),
+    ("secType", "contract.secType", None),
+    ("lastTradeDateOrContractMonth", "contract.lastTradeDateOrContractMonth", None),
+    ("strike", "contract.strike", format_float),
+    ("right", "contract.right", None),
+    ("multiplier", "contract.multiplier", None),
+    ("exchange", "contract.exchange", None),
+    ("primaryExchange", "contract.primaryExchange", None),
+    ("currency", "contract.currency", None),
+    ("localSymbol", "contract.localSymbol", None),
+    ("tradingClass", "contract.tradingClass", None),
+    ("includeExpired", "contract.includeExpired", None),
+    ("secIdType", "contract.secIdType", None),
+    ("secId", "contract.secId", None),
+    ("description", "contract.description", None),
+    ("issuerId", "contract.issuerId", None),
+    ("comboLegsDescrip", "contract.comboLegsDescrip", format_combo_legs_descrip),
+    ("comboLegs", "contract.comboLegs", format_combo_legs),
+    ("deltaNeutralContract", "contract.deltaNeutralContract", format_delta_neutral_contract),
+    ("marketName", "marketName", None),
+    ("minTick", "minTick", format_float),
+    ("orderTypes", "orderTypes", None),
+    ("validExchanges", "validExchanges", None),
+    ("priceMagnifier", "priceMagnifier", format_int),
+    ("underConId", "underConId", format_int),
+    ("longName", "longName", None),
+    ("contractMonth", "contractMonth", None),
+    ("industry", "industry", None),
+    ("category", "category", None),
+    ("subcategory", "subcategory", None),
+    ("timeZoneId", "timeZoneId", None),
+    ("tradingHours", "tradingHours", None),
+    ("liquidHours", "liquidHours", None),
+    ("evRule", "evRule", None),
+    ("evMultiplier", "evMultiplier", format_int),
+    ("aggGroup", "aggGroup", format_int),
+    ("underSymbol", "underSymbol", None),
+    ("underSecType", "underSecType", None),
+    ("marketRuleIds", "marketRuleIds", None),
+    ("secIdList", "secIdList", None),
+    ("realExpirationDate", "realExpirationDate", None),
+    ("lastTradeTime", "lastTradeTime", None),
+    ("stockType", "stockType", None),
+    ("minSize", "minSize", format_decimal),
+    ("sizeIncrement", "sizeIncrement", format_decimal),
+    ("suggestedSizeIncrement", "suggestedSizeIncrement", format_decimal),
+    ("cusip", "cusip", None),
+    ("ratings", "ratings", None),
+    ("descAppend", "descAppend", None),
+    ("bondType", "bondType", None),
+    ("couponType", "couponType", None),
+    ("callable", "callable", None),
+    ("putable", "putable", None),
+    ("coupon", "coupon", None),
+    ("convertible", "convertible", None),
+    ("maturity", "maturity", None),
+    ("issueDate", "issueDate", None),
+    ("nextOptionDate", "nextOptionDate", None),
+    ("nextOptionType", "nextOptionType", None),
+    ("nextOptionPartial", "nextOptionPartial", None),
+    ("notes", "notes", None),
+)
+CONTRACT_DETAILS_HEADER: Tuple[str, ...] = tuple(name for name, _, _ in CONTRACT_DETAILS_FIELDS)
+CONTRACT_DETAILS_GETTER: attrgetter = attrgetter(*(path for _, path, _ in CONTRACT_DETAILS_FIELDS))
+CONTRACT_DETAILS_FORMATTERS: Tuple[Tuple[int, Callable[[Any], str]], ...] = tuple(
+    (i, formatter) for i, (_, _, formatter) in enumerate(CONTRACT_DETAILS_FIELDS) if formatter
+)
 
-    return symbol
 
-def generate_localtime(str_datetime: str) -> datetime | None:
-    # 把"20230406 09:39:00 Hongkong" 变成 本地时区的 时间
-    strTimeList = str_datetime.split(" ")
-    if len(strTimeList) > 2:
-        bar_tz = pytz.timezone(strTimeList[2])
-        dt: datetime = bar_tz.localize(datetime.strptime(strTimeList[0] + " " + strTimeList[1], "%Y%m%d %H:%M:%S"))
-        
-        dt_local = dt.astimezone(pytz.timezone("Asia/Shanghai"))
-        return dt_local
-    else:
-        return None
\ No newline at end of file
+def generate_contract_details_row(c: ContractDetails) -> tuple:
+    """生成合约详情的字符串元组（模块级函数，可被pickle）"""
+    fields: list = list(CONTRACT_DETAILS_GETTER(c))
+    for i, formatter in CONTRACT_DETAILS_FORMATTERS:
+        fields[i] = formatter(fields[i])
+    return tuple(map(str, fields))
+
+
+def clone_data(data: Any) -> Any:
+    """浅拷贝数据对象（比copy.copy少了__reduce_ex__的通用分派）"""
+    cls: type = data.__class__
+    new_data: Any = cls.__new__(cls)
+    new_data.__dict__.update(data.__dict__)
+    return new_data
+
+
+def clear_contract_cache() -> None:
+    """清空合约代码解析和生成的缓存"""
+    parse_ib_contract.cache_clear()
+    join_symbol.cache_clear()
+
+
+# 本地时间缓存，避免每个tick回调都查询时区生成新的datetime
+_last_ns: int = 0
+_last_dt: datetime = None
+
+
+def now_local() -> datetime:
+    """获取本地时区当前时间（1毫秒内复用缓存结果）"""
+    global _last_ns, _last_dt
+
+    now_ns: int = time.monotonic_ns()
+    if now_ns - _last_ns > 1_000_000 or _last_dt is None:
+        _last_ns = now_ns
+        _last_dt = datetime.now(LOCAL_TZ)
+
+    return _last_dt
+
+
+# 撤单时间字符串缓存，同一秒内的撤单复用格式化结果
+_cancel_second: int = 0
+_cancel_time: str = ""
+
+
+def now_cancel_time() -> str:
+    """获取撤单时间字符串（IB撤单时间精度为秒）"""
+    global _cancel_second, _cancel_time
+
+    second: int = int(time.time())
+    if second != _cancel_second:
+        # LOCAL_TZ即系统本地时区，直接使用time.localtime避免时区转换
+        _cancel_time = time.strftime("%Y%m%d-%H:%M:%S", time.localtime(second))
+        _cancel_second = second
+
+    return _cancel_time